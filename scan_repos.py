@@ -1,18 +1,150 @@
 import os
 import json
-from pathlib import Path
-from openai import OpenAI, APIConnectionError, APIError, APITimeoutError
+import httpx
+import orjson
+from openai import AsyncOpenAI, APIConnectionError, APIError, APITimeoutError, InternalServerError, RateLimitError
+import asyncio
+import contextlib
+import random
+import gzip
+import io
+import fnmatch
 import hashlib
+import mmap
 from datetime import datetime
-import time
 import sys
 import re
+import shutil
+import sqlite3
+import threading
+from collections import defaultdict
+from concurrent.futures import ThreadPoolExecutor
 
 # State tracking files
 STATE_FILE = "scan_state.json"
-FINDINGS_DB = "code_analysis_findings.json"
+COMPLETED_FOLDERS_LOG = "scan_completed_folders.jsonl"  # Folders finished since the last state save, one per line
+FINDINGS_DB = "code_analysis_findings.db"
+LEGACY_FINDINGS_JSON = "code_analysis_findings.json"  # Written by older versions; imported once
 PROGRESS_LOG = "scan_progress.log"
+REPORT_FILE = "code_analysis_report.md"
+REPORT_FRAGMENT_DIR = "reports"  # Pre-rendered per-file report sections, reused while a file is unchanged
+REPORT_INDEX = os.path.join(REPORT_FRAGMENT_DIR, "index.json")
+REPORT_INDEX_VERSION = 3  # Bump when issue keys or fragment layout change, forcing a full re-render
+HASH_SCHEME_VERSION = 1  # findings db user_version once content hashes are BLAKE2b-128 (0 = SHA-256)
+BATCH_INPUT_FILE = "scan_batch_input.jsonl"
+LEGACY_PROMPT_CACHE = "prompt_cache.jsonl"  # Chunk answers cached by older versions; keyed by an outdated PROMPT_VERSION
 CONFIG_FILE = "config.json"
+HEAD_SAMPLE_SIZE = 4096  # Bytes hashed for the cheap "unchanged?" check
+SNIFF_SIZE = 8192  # Bytes inspected to reject binary/minified files before hashing
+MAX_LINE_LENGTH = 5000  # Any longer line means minified or generated code
+DEFAULT_SKIP_PATTERNS = ["*_pb2.py", "*_pb2_grpc.py", "*.pb.go", "*.generated.*", "*.g.cs", "package-lock.json", "yarn.lock"]
+MMAP_HASH_THRESHOLD = 64 * 1024  # Hash larger files through mmap instead of reading them
+WORK_QUEUE_SIZE = 256  # Folders the tree walker may run ahead of the scanner
+READ_WORKERS = 4  # Threads reading source files so disk waits don't stall the event loop
+MAX_RETRY_DELAY = 30  # Cap in seconds for exponential backoff between retries
+AIMD_DECREASE = 0.5  # In-flight request cap is multiplied by this when the server pushes back
+AIMD_INCREASE_AFTER = 20  # Consecutive successes before the cap grows back by one
+MIN_SCAN_CHARS = 20  # Files with less code than this are recorded clean without an LLM call
+CHUNK_SIZE = 12000  # Preferred chunk size when splitting on function/class boundaries
+OUTPUT_TOKENS_BASE = 96  # Output budget for an empty issue list; grows by OUTPUT_TOKENS_PER_ISSUE up to the configured max_tokens
+OUTPUT_TOKENS_PER_ISSUE = 64
+CHARS_PER_EXPECTED_ISSUE = 2000  # One extra issue budgeted per this much code, on top of MIN_EXPECTED_ISSUES
+MIN_EXPECTED_ISSUES = 5  # SYSTEM_PROMPT asks for 0-5 issues, so even a tiny file gets room for five
+STOP_SEQUENCES = ["\n```", "\n\n\n"]  # Cut off trailing fences or rambling after the JSON object
+CHUNK_OVERLAP = 500  # Overlap between windows when a single chunk exceeds max_input_chars
+SMALL_FILE_CHARS = 2000  # Files smaller than this are packed several to a request
+FILES_PER_REQUEST = 8  # Most small files packed into one request
+MAX_PACKED_CHARS = 10000  # Most code packed into one request
+
+# Kept byte-identical across requests so LM Studio / vLLM prefix caching can reuse it
+SYSTEM_PROMPT = """You are a static analysis assistant. Output ONLY valid JSON.
+
+Schema:
+{
+  "issues": [
+    {
+      "type": "security" | "pattern" | "regression",
+      "severity": "high" | "medium" | "low",
+      "description": "Specific, actionable problem statement",
+      "line_hint": "One short code line or 'L<start>-L<end>' range",
+      "cwe": "CWE-### if security, else ''"
+    }
+  ]
+}
+
+Analyze the file given by the user.
+
+Checklist (answer by emitting issues that match):
+1) Security: input validation, auth/authz gaps, unsafe deserialization, SQL/ORM injection, path traversal, SSRF, shell/exec misuse, secrets in code, weak crypto, insecure TLS.
+2) Regressions: dead flags, removal of essential checks, brittle mocks, changes in error handling that swallow exceptions.
+3) Legacy patterns: deprecated APIs, Python2 remnants, outdated PHP/React idioms, synchronous IO in async paths, global mutable state, tight coupling.
+
+Rules:
+- If unsure, omit the issue (prefer precision).
+- Prefer 0–5 issues; no filler.
+- Use **one line** or a small **line range** in line_hint.
+- If no issues, return {"issues":[]} exactly.
+"""
+
+ISSUE_LIST_SCHEMA = {
+    "type": "array",
+    "items": {
+        "type": "object",
+        "properties": {
+            "type": {"type": "string", "enum": ["security", "pattern", "regression"]},
+            "severity": {"type": "string", "enum": ["high", "medium", "low"]},
+            "description": {"type": "string"},
+            "line_hint": {"type": "string"},
+            "cwe": {"type": "string"}
+        },
+        "required": ["type", "severity", "description", "line_hint", "cwe"],
+        "additionalProperties": False
+    }
+}
+
+# Constrains decoding to SYSTEM_PROMPT's schema on servers with structured output (LM Studio, vLLM, llama.cpp)
+ISSUE_SCHEMA_FORMAT = {
+    "type": "json_schema",
+    "json_schema": {
+        "name": "issues",
+        "strict": True,
+        "schema": {
+            "type": "object",
+            "properties": {"issues": ISSUE_LIST_SCHEMA},
+            "required": ["issues"],
+            "additionalProperties": False
+        }
+    }
+}
+# Same issue list once per file, for requests carrying several small files
+FILES_SCHEMA_FORMAT = {
+    "type": "json_schema",
+    "json_schema": {
+        "name": "files",
+        "strict": True,
+        "schema": {
+            "type": "object",
+            "properties": {
+                "files": {
+                    "type": "array",
+                    "items": {
+                        "type": "object",
+                        "properties": {"path": {"type": "string"}, "issues": ISSUE_LIST_SCHEMA},
+                        "required": ["path", "issues"],
+                        "additionalProperties": False
+                    }
+                }
+            },
+            "required": ["files"],
+            "additionalProperties": False
+        }
+    }
+}
+FILES_INSTRUCTION = 'Analyze the following files and return {"files": [{"path": "<path as given>", "issues": [...]}]} with one entry per file; each issues list follows the schema above.'
+JSON_OBJECT_FORMAT = {"type": "json_object"}
+REPLY_PARSER_VERSION = 2  # Bump when reply parsing changes, so answers cached by the old parser aren't reused
+# Changes whenever the rubric or schema is edited, so cached answers to the old prompt aren't reused
+PROMPT_VERSION = hashlib.blake2b(f"{SYSTEM_PROMPT}{json.dumps(ISSUE_SCHEMA_FORMAT)}{REPLY_PARSER_VERSION}".encode(), digest_size=8).hexdigest()
 
 def load_config():
     """Load configuration from config.json, or exit with helpful message"""
@@ -22,104 +154,495 @@ def load_config():
         print(f"   Example: cp config.example.json {CONFIG_FILE}")
         sys.exit(1)
     
-    with open(CONFIG_FILE, 'r') as f:
-        config = json.load(f)
+    with open(CONFIG_FILE, 'rb') as f:
+        config = orjson.loads(f.read())
     
     return config
 
 # Load configuration
 config = load_config()
-client = OpenAI(
+# One pooled HTTP/2 client shared by every request; closed by run_with_client
+# Pool settings belong to the transport: AsyncClient ignores its own limits/http2 once transport= is given
+http_client = httpx.AsyncClient(
+    transport=httpx.AsyncHTTPTransport(
+        retries=2,
+        http2=True,
+        limits=httpx.Limits(max_connections=64, max_keepalive_connections=64)
+    )
+)
+# SDK retries off: request_analysis is the only retry layer, backing off outside request_slots
+client = AsyncOpenAI(
     base_url=config['lm_studio']['base_url'],
-    api_key=config['lm_studio']['api_key']
+    api_key=config['lm_studio']['api_key'],
+    http_client=http_client,
+    max_retries=0
 )
 
+class AIMDLimiter:
+    """In-flight request cap that halves when the server is overloaded and creeps back up on success"""
+    
+    def __init__(self, max_cap):
+        self.max_cap = self.cap = max_cap
+        self.slots = asyncio.Semaphore(max_cap)
+        self.debt = 0  # Permits to swallow on release after the cap was lowered
+        self.successes = 0
+        self.epoch = 0  # Bumped on every decrease, so one overload burst only lowers the cap once
+    
+    @contextlib.asynccontextmanager
+    async def slot(self):
+        await self.slots.acquire()
+        epoch = self.epoch
+        try:
+            yield
+        except (RateLimitError, InternalServerError, APITimeoutError):
+            if epoch == self.epoch:
+                self.decrease()
+            raise
+        else:
+            self.successes += 1
+            if self.successes >= AIMD_INCREASE_AFTER and self.cap < self.max_cap:
+                self.increase()
+        finally:
+            if self.debt:
+                self.debt -= 1
+            else:
+                self.slots.release()
+    
+    def decrease(self):
+        new_cap = max(1, int(self.cap * AIMD_DECREASE))
+        self.debt += self.cap - new_cap
+        self.cap = new_cap
+        self.successes = 0
+        self.epoch += 1
+        log_progress(f"🐢 Server overloaded, lowering concurrency to {self.cap}")
+    
+    def increase(self):
+        self.cap += 1
+        self.successes = 0
+        if self.debt:
+            self.debt -= 1
+        else:
+            self.slots.release()
+        log_progress(f"Raising concurrency to {self.cap}")
+
+# Caps in-flight LLM requests across all files and chunks; retries back off outside it
+request_slots = AIMDLimiter(config['scan'].get('max_concurrency', 8))
+
+async def run_with_client(coro):
+    """Run a coroutine, closing the shared HTTP client when it finishes or fails"""
+    try:
+        return await coro
+    finally:
+        await client.close()
+
 def load_state():
     """Load scanning state - tracks progress through directory tree"""
     if os.path.exists(STATE_FILE):
-        with open(STATE_FILE, 'r') as f:
-            return json.load(f)
-    return {
-        'last_scanned_folder': None,
-        'last_scanned_file': None,
-        'completed_folders': [],
-        'last_run': None,
-        'total_files_scanned': 0,
-        'total_files_skipped': 0,
-        'scan_start_time': None
-    }
+        with open(STATE_FILE, 'rb') as f:
+            state = orjson.loads(f.read())
+        # Stored as a list in JSON; a set in memory for O(1) membership checks
+        state['completed_folders'] = set(state.get('completed_folders', []))
+    else:
+        state = {
+            'last_scanned_folder': None,
+            'last_scanned_file': None,
+            'completed_folders': set(),
+            'last_run': None,
+            'total_files_scanned': 0,
+            'total_files_skipped': 0,
+            'scan_start_time': None
+        }
+    
+    # Fold in folders completed after the last full save
+    if os.path.exists(COMPLETED_FOLDERS_LOG):
+        with open(COMPLETED_FOLDERS_LOG, 'rb') as f:
+            for line in f:
+                try:
+                    state['completed_folders'].add(orjson.loads(line))
+                except orjson.JSONDecodeError:
+                    pass  # Torn last line from a crash
+    return state
+
+def content_hash(data):
+    """BLAKE2b-128 hex digest - used for identity and dedup only, so a fast non-crypto-grade size is enough"""
+    return hashlib.blake2b(data, digest_size=16).hexdigest()
+
+def atomic_write(path, data):
+    """Write bytes to a temp file and rename it over path, so a crash never leaves a truncated file"""
+    tmp_path = path + ".tmp"
+    with open(tmp_path, 'wb') as f:
+        f.write(data)
+        f.flush()
+        os.fsync(f.fileno())
+    os.replace(tmp_path, path)
 
 def save_state(state):
-    with open(STATE_FILE, 'w') as f:
-        json.dump(state, f, indent=2)
+    data = {**state, 'completed_folders': sorted(state['completed_folders'])}
+    atomic_write(STATE_FILE, orjson.dumps(data, option=orjson.OPT_INDENT_2))
+    # The full set is in STATE_FILE now, so the append log can start over
+    if os.path.exists(COMPLETED_FOLDERS_LOG):
+        os.remove(COMPLETED_FOLDERS_LOG)
+
+def append_completed_folder(folder):
+    """Record one finished folder without rewriting the whole state file"""
+    with open(COMPLETED_FOLDERS_LOG, 'ab') as f:
+        f.write(orjson.dumps(folder) + b'\n')
+
+class FindingsStore:
+    """SQLite-backed findings: one row per analyzed content hash, one row per file path.
+    
+    WAL journaling lets the tree walker thread read while the scanner writes, and each
+    result is committed on its own, so checkpoints never rewrite the whole database.
+    """
+    
+    def __init__(self, path=FINDINGS_DB):
+        self.path = path
+        self.local = threading.local()
+        self.connection.executescript("""
+            CREATE TABLE IF NOT EXISTS results (
+                hash TEXT PRIMARY KEY,
+                scanned_at TEXT,
+                file_size INTEGER,
+                issues TEXT,
+                model_meta TEXT,
+                scan_error TEXT
+            );
+            CREATE TABLE IF NOT EXISTS files (
+                path TEXT PRIMARY KEY,
+                hash TEXT NOT NULL,
+                size INTEGER,
+                mtime_ns INTEGER,
+                head_hash TEXT
+            );
+            CREATE TABLE IF NOT EXISTS skipped (
+                path TEXT PRIMARY KEY,
+                reason TEXT,
+                size INTEGER,
+                mtime_ns INTEGER
+            );
+            CREATE TABLE IF NOT EXISTS prompt_cache (
+                key TEXT PRIMARY KEY,
+                analysis TEXT NOT NULL
+            );
+        """)
+    
+    @property
+    def connection(self):
+        """One connection per thread - sqlite3 connections can't be shared across threads"""
+        conn = getattr(self.local, 'conn', None)
+        if conn is None:
+            conn = sqlite3.connect(self.path)
+            conn.execute("PRAGMA journal_mode=WAL")
+            conn.execute("PRAGMA synchronous=NORMAL")
+            self.local.conn = conn
+        return conn
+    
+    @property
+    def hash_version(self):
+        return self.connection.execute("PRAGMA user_version").fetchone()[0]
+    
+    def set_hash_version(self, version):
+        with self.connection as conn:
+            conn.execute(f"PRAGMA user_version = {int(version)}")
+    
+    def migrate_hashes(self):
+        """Re-key SHA-256 results to BLAKE2b-128 for files unchanged on disk; changed files get rescanned"""
+        conn = self.connection
+        rekeyed = {}
+        file_updates = []
+        for file_path, old_hash in conn.execute("SELECT path, hash FROM files WHERE length(hash) = 64").fetchall():
+            try:
+                with open(file_path, 'rb') as f:
+                    data = f.read()
+            except OSError:
+                continue
+            if hashlib.sha256(data).hexdigest() != old_hash:
+                continue
+            rekeyed[old_hash] = new_hash = content_hash(data)
+            file_updates.append((new_hash, content_hash(data[:HEAD_SAMPLE_SIZE]), file_path))
+        
+        with conn:
+            conn.executemany("""
+                INSERT OR IGNORE INTO results (hash, scanned_at, file_size, issues, model_meta, scan_error)
+                SELECT ?, scanned_at, file_size, issues, model_meta, scan_error FROM results WHERE hash = ?
+            """, ((new_hash, old_hash) for old_hash, new_hash in rekeyed.items()))
+            conn.executemany("UPDATE files SET hash = ?, head_hash = ? WHERE path = ?", file_updates)
+            # Old rows still referenced by changed files stay until those files are rescanned
+            conn.execute("DELETE FROM results WHERE length(hash) = 64 AND hash NOT IN (SELECT hash FROM files)")
+            conn.execute(f"PRAGMA user_version = {HASH_SCHEME_VERSION}")
+        return len(file_updates)
+    
+    def has_result(self, file_hash):
+        row = self.connection.execute("SELECT 1 FROM results WHERE hash = ?", (file_hash,)).fetchone()
+        return row is not None
+    
+    def path_status(self, file_path):
+        """(analyzed, rejected) for a path in one query: stored file stat dict and (size, mtime_ns) it was skipped at, each None if unknown"""
+        size, mtime_ns, head_hash, result_hash, skipped_size, skipped_mtime_ns = self.connection.execute("""
+            SELECT files.size, files.mtime_ns, files.head_hash, results.hash, skipped.size, skipped.mtime_ns
+            FROM (SELECT ? AS path) AS p
+            LEFT JOIN files ON files.path = p.path
+            LEFT JOIN results ON results.hash = files.hash
+            LEFT JOIN skipped ON skipped.path = p.path
+        """, (file_path,)).fetchone()
+        # A path whose results row was deleted counts as never analyzed, so it gets rescanned
+        analyzed = None if size is None or result_hash is None else {'size': size, 'mtime_ns': mtime_ns, 'head_hash': head_hash}
+        rejected = None if skipped_size is None else (skipped_size, skipped_mtime_ns)
+        return analyzed, rejected
+    
+    def mark_skipped(self, file_path, reason, st):
+        """Remember why a file was not sent to the model, so it isn't re-read next run"""
+        with self.connection as conn:
+            conn.execute(
+                "INSERT OR REPLACE INTO skipped (path, reason, size, mtime_ns) VALUES (?, ?, ?, ?)",
+                (file_path, reason, st.st_size, st.st_mtime_ns)
+            )
+    
+    def get_cached_analysis(self, key):
+        """Parsed model answer stored for a prompt cache key, or None"""
+        row = self.connection.execute("SELECT analysis FROM prompt_cache WHERE key = ?", (key,)).fetchone()
+        return None if row is None else orjson.loads(row[0])
+    
+    def cache_analysis(self, key, analysis):
+        with self.connection as conn:
+            conn.execute(
+                "INSERT OR REPLACE INTO prompt_cache (key, analysis) VALUES (?, ?)",
+                (key, orjson.dumps(analysis).decode())
+            )
+    
+    INSERT_FILE = "INSERT OR REPLACE INTO files (path, hash, size, mtime_ns, head_hash) VALUES (?, ?, ?, ?, ?)"
+    INSERT_RESULT = "INSERT OR REPLACE INTO results (hash, scanned_at, file_size, issues, model_meta, scan_error) VALUES (?, ?, ?, ?, ?, ?)"
+    
+    @staticmethod
+    def file_row(file_path, file_hash, file_stat):
+        file_stat = file_stat or {}
+        return (file_path, file_hash, file_stat.get('size'), file_stat.get('mtime_ns'), file_stat.get('head_hash'))
+    
+    @staticmethod
+    def result_row(file_hash, entry):
+        return (
+            file_hash,
+            entry.get('scanned_at'),
+            entry.get('file_size'),
+            orjson.dumps(entry.get('findings', [])).decode(),
+            orjson.dumps(entry.get('model_meta')).decode(),
+            orjson.dumps(entry['scan_error']).decode() if 'scan_error' in entry else None
+        )
+    
+    def link_path(self, file_path, file_hash, file_stat=None):
+        """Point a path at an existing analysis of identical content"""
+        with self.connection as conn:
+            conn.execute(self.INSERT_FILE, self.file_row(file_path, file_hash, file_stat))
+    
+    def save_result(self, file_path, file_hash, entry, file_stat=None):
+        """Store an analysis for this content and point the path at it, in one transaction"""
+        with self.connection as conn:
+            conn.execute(self.INSERT_RESULT, self.result_row(file_hash, entry))
+            conn.execute(self.INSERT_FILE, self.file_row(file_path, file_hash, file_stat))
+    
+    def import_findings(self, findings):
+        """Bulk-load a content-addressed findings dict in one transaction"""
+        file_stats = findings.get('file_stats', {})
+        with self.connection as conn:
+            conn.executemany(self.INSERT_RESULT, (
+                self.result_row(file_hash, entry) for file_hash, entry in findings['by_hash'].items()
+            ))
+            conn.executemany(self.INSERT_FILE, (
+                self.file_row(file_path, file_hash, file_stats.get(file_path))
+                for file_path, file_hash in findings['by_path'].items()
+            ))
+    
+    def count_files(self):
+        return self.connection.execute(
+            "SELECT COUNT(*) FROM files JOIN results ON results.hash = files.hash"
+        ).fetchone()[0]
+    
+    def get_result(self, file_hash):
+        """Full analysis entry for one content hash"""
+        row = self.connection.execute(
+            "SELECT scanned_at, file_size, issues, model_meta, scan_error FROM results WHERE hash = ?", (file_hash,)
+        ).fetchone()
+        scanned_at, file_size, issues, model_meta, scan_error = row
+        entry = {
+            'scanned_at': scanned_at,
+            'file_size': file_size,
+            'findings': orjson.loads(issues),
+            'model_meta': orjson.loads(model_meta)
+        }
+        if scan_error is not None:
+            entry['scan_error'] = orjson.loads(scan_error)
+        return entry
+    
+    def iter_file_hashes(self):
+        """Stream (file_path, hash, scanned_at) for every known path without loading everything into memory"""
+        return self.connection.execute("""
+            SELECT files.path, files.hash, results.scanned_at
+            FROM files JOIN results ON results.hash = files.hash
+        """)
 
 def load_findings():
-    if os.path.exists(FINDINGS_DB):
-        with open(FINDINGS_DB, 'r') as f:
-            return json.load(f)
-    return {}
+    """Open the findings store, importing the JSON findings file of older versions on first use"""
+    is_new = not os.path.exists(FINDINGS_DB)
+    findings_db = FindingsStore(FINDINGS_DB)
+    if is_new:
+        for legacy_path in (LEGACY_FINDINGS_JSON, LEGACY_FINDINGS_JSON + ".gz"):
+            if os.path.exists(legacy_path):
+                opener = gzip.open if legacy_path.endswith(".gz") else open
+                with opener(legacy_path, 'rb') as f:
+                    findings = orjson.loads(f.read())
+                if 'by_hash' not in findings:
+                    findings = migrate_findings(findings)
+                findings_db.import_findings(findings)
+                log_progress(f"Imported {len(findings['by_path'])} files from {legacy_path} into {FINDINGS_DB}")
+                break
+        findings_db.set_hash_version(HASH_SCHEME_VERSION)
+    elif findings_db.hash_version < HASH_SCHEME_VERSION:
+        log_progress("Migrating findings from SHA-256 to BLAKE2b content hashes (one time)...")
+        rekeyed = findings_db.migrate_hashes()
+        log_progress(f"Re-keyed {rekeyed} unchanged files; changed or missing files will be rescanned")
+    if os.path.exists(LEGACY_PROMPT_CACHE):
+        # Its answers were cached under an older PROMPT_VERSION and can never match again
+        os.remove(LEGACY_PROMPT_CACHE)
+    return findings_db
+
+def migrate_findings(legacy):
+    """Fold a legacy path-keyed findings file into the content-addressed layout"""
+    findings = {'by_hash': {}, 'by_path': {}}
+    for file_path, entry in legacy.items():
+        entry = dict(entry)
+        file_hash = entry.pop('hash', None)
+        if file_hash is None:
+            continue
+        # Legacy hashes are MD5; re-key files that are unchanged on disk so they aren't rescanned
+        try:
+            if hashlib.md5(read_source(file_path).encode()).hexdigest() == file_hash:
+                file_hash = get_file_hash(file_path)
+        except OSError:
+            pass
+        findings['by_hash'][file_hash] = entry
+        findings['by_path'][file_path] = file_hash
+    return findings
 
-def save_findings(findings):
-    with open(FINDINGS_DB, 'w') as f:
-        json.dump(findings, f, indent=2)
+log_lock = threading.Lock()  # The tree walker thread logs too
 
 def log_progress(message):
     """Append to progress log with timestamp"""
     timestamp = datetime.now().isoformat()
     log_line = f"[{timestamp}] {message}\n"
-    print(log_line.strip())
-    with open(PROGRESS_LOG, 'a') as f:
-        f.write(log_line)
+    with log_lock:
+        print(log_line.strip())
+        with open(PROGRESS_LOG, 'a') as f:
+            f.write(log_line)
 
-def get_file_hash(content):
-    return hashlib.md5(content.encode()).hexdigest()
+def get_file_hash(file_path, sample=None):
+    """BLAKE2b-128 of the file's bytes, hashed straight from disk without decoding"""
+    # A sniff sample shorter than SNIFF_SIZE already holds the whole file
+    if sample is not None and len(sample) < SNIFF_SIZE:
+        return content_hash(sample)
+    with open(file_path, 'rb') as f:
+        if os.fstat(f.fileno()).st_size > MMAP_HASH_THRESHOLD:
+            with mmap.mmap(f.fileno(), 0, access=mmap.ACCESS_READ) as view:
+                return content_hash(view)
+        return content_hash(f.read())
 
-def should_scan(file_path, content, findings_db):
-    """Check if we've already scanned this exact content"""
-    if file_path not in findings_db:
+def read_source(file_path):
+    """Read a file as text for the LLM prompt"""
+    with open(file_path, 'r', encoding='utf-8', errors='ignore') as f:
+        return f.read()
+
+def read_head(file_path, size=HEAD_SAMPLE_SIZE):
+    with open(file_path, 'rb') as f:
+        return f.read(size)
+
+def should_scan(file_path, file_hash, findings_db):
+    """Check if we've already scanned this exact content, at this path or any other"""
+    return not findings_db.has_result(file_hash)
+
+def get_file_stat(st, head):
+    """Size, mtime and head hash - enough to tell an unchanged file without reading it all"""
+    return {'size': st.st_size, 'mtime_ns': st.st_mtime_ns, 'head_hash': content_hash(head)}
+
+def should_scan_fast(file_path, st, findings_db):
+    """Cheap pre-check: False if size, mtime and first 4KB all match the last analyzed or rejected version"""
+    known, rejected = findings_db.path_status(file_path)
+    if rejected == (st.st_size, st.st_mtime_ns):
+        return False
+    if known is None:
         return True
-    file_hash = get_file_hash(content)
-    return findings_db[file_path].get('hash') != file_hash
-
-def extract_json_block(text: str) -> str | None:
-    """Extract first balanced JSON object from text"""
-    # Strip code fences
-    text = re.sub(r"^```(?:json)?\s*|\s*```$", "", text.strip(), flags=re.MULTILINE)
-    # Find first balanced JSON object
+    if st.st_size != known['size'] or st.st_mtime_ns != known['mtime_ns']:
+        return True
+    return content_hash(read_head(file_path)) != known['head_hash']
+
+def skip_reason(file_name, sample, skip_patterns):
+    """Why a file isn't worth an LLM call (binary, minified, generated), or None to scan it"""
+    if any(fnmatch.fnmatch(file_name, pattern) for pattern in skip_patterns):
+        return "generated"
+    if b'\0' in sample or looks_binary(sample):
+        return "binary"
+    if any(len(line) > MAX_LINE_LENGTH for line in sample.split(b'\n')):
+        return "minified"
+    return None
+
+JSON_DECODER = json.JSONDecoder()
+
+def extract_json_block(text: str) -> dict | None:
+    """Parse the JSON object starting at the first '{' in text (prose or code fences around it)"""
+    # Only the outermost object: retrying at later braces would return a nested issue from a truncated reply
     start = text.find('{')
     if start == -1:
         return None
-    depth = 0
-    for i, ch in enumerate(text[start:], start=start):
-        if ch == '{':
-            depth += 1
-        elif ch == '}':
-            depth -= 1
-            if depth == 0:
-                return text[start:i+1]
-    return None
+    try:
+        # raw_decode parses in C, skips braces inside strings and stops at the object's end
+        return JSON_DECODER.raw_decode(text, start)[0]
+    except ValueError:
+        return None
 
 def try_parse_json(s: str) -> dict | None:
     """Try to parse JSON, return None on failure"""
+    # orjson for the common whole-reply case; extract_json_block keeps the stdlib decoder for raw_decode
     try:
-        return json.loads(s)
+        return orjson.loads(s)
     except Exception:
         return None
 
-def looks_binary(content: str) -> bool:
-    """Check if content looks like binary data"""
-    sample = content[:4096]
-    weird = sum(1 for ch in sample if ord(ch) == 0 or ord(ch) > 0xFFFF)
+CODE_FENCE_RE = re.compile(r'```[A-Za-z]*')
+TRAILING_COMMA_RE = re.compile(r',\s*([}\]])')
+
+def sanitize_json_text(text: str) -> str:
+    """Strip code fences and trailing commas, the usual ways a model breaks otherwise valid JSON"""
+    return TRAILING_COMMA_RE.sub(r'\1', CODE_FENCE_RE.sub('', text))
+
+def parse_model_json(text: str, key: str = "issues") -> dict | None:
+    """Parse a model reply holding a list under key, digging the JSON object out only if the server ignored response_format"""
+    parsed = try_parse_json(text)
+    # A bare list or scalar isn't an answer; look for an object in the text instead
+    if not isinstance(parsed, dict):
+        parsed = extract_json_block(text) or extract_json_block(sanitize_json_text(text))
+    # Anything else (e.g. a lone issue dug out of a truncated reply) would be recorded as clean
+    return parsed if isinstance(parsed, dict) and isinstance(parsed.get(key), list) else None
+
+# Bytes that occur in text: tab/newline/CR/etc, printable ASCII, and anything >= 0x80 (UTF-8 sequences)
+TEXT_BYTES = bytes(range(9, 14)) + bytes(range(32, 127)) + bytes(range(128, 256))
+
+def looks_binary(raw: bytes) -> bool:
+    """Check if raw bytes look like binary data"""
+    sample = raw[:4096]
+    # translate() deletes every text byte in C; what's left are control characters
+    weird = len(sample.translate(None, TEXT_BYTES))
     return weird > len(sample) * 0.05  # More than 5% weird chars
 
+CODE_MARKER_RE = re.compile(r"(?:^|\n)(?:def\s+|class\s+|function\s+|public\s+function\s+|private\s+function\s+)")
+BLANK_LINES_RE = re.compile(r'\n{4,}')
+
 def split_code(content: str, max_chars: int = 12000) -> list:
     """Split large code files into chunks by function/class boundaries"""
     if len(content) <= max_chars:
         return [content]
     
     # Find function/class markers
-    markers = r"(?:^|\n)(?:def\s+|class\s+|function\s+|public\s+function\s+|private\s+function\s+)"
-    parts = re.split(markers, content)
+    parts = CODE_MARKER_RE.split(content)
+    has_def = "def " in content
+    has_class = "class " in content
     
     chunks, buf = [], ""
     for p in parts:
@@ -129,9 +652,9 @@ def split_code(content: str, max_chars: int = 12000) -> list:
         candidate = p
         if not p.lstrip().startswith(("def ", "class ", "function", "public function", "private function")):
             # Check if previous part had a marker
-            if "def " in content:
+            if has_def:
                 candidate = "def " + p
-            elif "class " in content:
+            elif has_class:
                 candidate = "class " + p
         
         if len(buf) + len(candidate) < max_chars:
@@ -149,88 +672,145 @@ def split_code(content: str, max_chars: int = 12000) -> list:
 def issue_key(issue: dict) -> str:
     """Generate a unique key for an issue to deduplicate"""
     base = f"{issue.get('type', '')}|{issue.get('description', '')}|{issue.get('line_hint', '')}"
-    return hashlib.md5(base.encode()).hexdigest()
+    return content_hash(base.encode())
 
-def scan_file_chunk(file_path, content_chunk, config, chunk_context="", max_retries=3, retry_delay=2):
-    """Send a code chunk to LLM for analysis with improved prompt and JSON extraction"""
-    # Improved prompt with checklist structure for Q4 models
-    prompt = f"""You are a static analysis assistant. Output ONLY valid JSON.
+def chunk_content(content, config):
+    """Split content into chunks that each fit the model's input budget"""
+    max_input_chars = config['scan'].get('max_input_chars', 40000)
+    chunks = []
+    for chunk in split_code(content, max_chars=min(CHUNK_SIZE, max_input_chars)):
+        if len(chunk) <= max_input_chars:
+            chunks.append(chunk)
+            continue
+        # A single function/class too big for the model: fall back to overlapping windows
+        step = max(max_input_chars - CHUNK_OVERLAP, 1)
+        for start in range(0, len(chunk) - CHUNK_OVERLAP, step):
+            chunks.append(chunk[start:start + max_input_chars])
+    return chunks
 
-Schema:
-{{
-  "issues": [
-    {{
-      "type": "security" | "pattern" | "regression",
-      "severity": "high" | "medium" | "low",
-      "description": "Specific, actionable problem statement",
-      "line_hint": "One short code line or 'L<start>-L<end>' range",
-      "cwe": "CWE-### if security, else ''"
-    }}
-  ]
-}}
+def compact_code(content):
+    """Strip trailing whitespace and squeeze runs of blank lines so fewer tokens are sent"""
+    text = '\n'.join(line.rstrip() for line in content.splitlines())
+    return BLANK_LINES_RE.sub('\n\n\n', text)
 
-Analyze File: {file_path}
+def expected_issues(content):
+    """Issues a piece of code this size plausibly has, for budgeting output tokens"""
+    return len(content) // CHARS_PER_EXPECTED_ISSUE + MIN_EXPECTED_ISSUES
 
-Checklist (answer by emitting issues that match):
-1) Security: input validation, auth/authz gaps, unsafe deserialization, SQL/ORM injection, path traversal, SSRF, shell/exec misuse, secrets in code, weak crypto, insecure TLS.
-2) Regressions: dead flags, removal of essential checks, brittle mocks, changes in error handling that swallow exceptions.
-3) Legacy patterns: deprecated APIs, Python2 remnants, outdated PHP/React idioms, synchronous IO in async paths, global mutable state, tight coupling.
+def build_chat_request(file_path, content_chunk, config, chunk_context=""):
+    """Build the chat completion payload used for both live and batch scans"""
+    content_chunk = compact_code(content_chunk)
+    user_message = f"File: {file_path}\n\n```\n{chunk_context}{content_chunk}\n```"
+    return chat_request_params(config, user_message, expected_issues(content_chunk), ISSUE_SCHEMA_FORMAT)
 
-Rules:
-- If unsure, omit the issue (prefer precision).
-- Prefer 0–5 issues; no filler.
-- Use **one line** or a small **line range** in line_hint.
-- If no issues, return {{"issues":[]}} exactly.
+def build_files_request(files, config):
+    """Build one chat completion payload covering several small (path, content) files"""
+    parts = [FILES_INSTRUCTION]
+    issues = 0
+    for file_path, content in files:
+        content = compact_code(content)
+        parts.append(f"File: {file_path}\n\n```\n{content}\n```")
+        issues += expected_issues(content)
+    return chat_request_params(config, "\n\n".join(parts), issues, FILES_SCHEMA_FORMAT, files=len(files))
 
-Code:
-{chunk_context}
-{content_chunk}
-"""
+def chat_request_params(config, user_message, issues, response_format, files=1):
+    """Chat completion payload with the output budget sized for the expected number of issues"""
+    # Static rubric goes first and unchanged so the server's prefix cache can reuse it
+    # A tighter output cap than the configured maximum keeps decode short; packed requests get one budget per file
+    budget = OUTPUT_TOKENS_BASE * files + OUTPUT_TOKENS_PER_ISSUE * issues
+    max_tokens = min(config['model'].get('max_tokens', 1024) * files, budget)
     
     # Get model config with defaults
-    temperature = config['model'].get('temperature', 0.1)
-    max_tokens = config['model'].get('max_tokens', 1024)
     top_p = config['model'].get('top_p', 0.2)
     
+    request_params = {
+        "model": config['model']['name'],
+        "messages": [
+            {"role": "system", "content": SYSTEM_PROMPT},
+            {"role": "user", "content": user_message}
+        ],
+        "temperature": config['model'].get('temperature', 0.1),
+        "max_tokens": max_tokens,
+        "stop": STOP_SEQUENCES,
+        "response_format": response_format
+    }
+    
+    # Add top_p if available
+    if top_p is not None:
+        request_params["top_p"] = top_p
+    
+    return request_params
+
+# Line starts of import/include statements across the scanned languages
+HEADER_SNIFF_CHARS = 8192  # Only this much of a file is split when looking for header lines
+IMPORT_PREFIXES = ('import ', 'from ', 'require', 'include', 'use ', 'using ', '#include', 'package ')
+
+def extract_header_context(content):
+    """Collect import/header lines so every chunk of a file keeps its context"""
+    # First 50 lines typically have imports/header; split only the head, not the whole file
+    lines = content[:HEADER_SNIFF_CHARS].split('\n', 50)[:50]
+    header_lines = [line for line in lines if line.lstrip().startswith(IMPORT_PREFIXES)]
+    return '\n'.join(header_lines) + '\n\n---\n\n' if header_lines else ''
+
+class TransientScanError(Exception):
+    """Analysis failed for a reason worth retrying on a later run (rate limit, server down, timeout)"""
+
+def retry_wait(attempt, retry_delay):
+    """Exponential backoff with jitter, capped at MAX_RETRY_DELAY seconds"""
+    # Full +/-50% jitter so requests that failed together don't retry in lockstep
+    return min(MAX_RETRY_DELAY, retry_delay * (2 ** attempt) * random.uniform(0.5, 1.5))
+
+def prompt_cache_key(config, content_chunk, chunk_context):
+    return content_hash(f"{config['model']['name']}|{PROMPT_VERSION}|{chunk_context}|{content_chunk}".encode())
+
+def is_cacheable_analysis(analysis):
+    """Only complete, well-formed answers are cached; anything else would be replayed forever"""
+    if not isinstance(analysis, dict) or 'error' in analysis:
+        return False
+    issues = analysis.get('issues')
+    return isinstance(issues, list) and all(isinstance(issue, dict) for issue in issues)
+
+async def scan_file_chunk(file_path, content_chunk, config, findings_db, chunk_context="", max_retries=5, retry_delay=2):
+    """Send a code chunk to LLM for analysis; raises TransientScanError if the server never answers"""
+    # Same model, prompt and code as a chunk answered before - no need to ask again
+    cache_key = prompt_cache_key(config, content_chunk, chunk_context)
+    cached = findings_db.get_cached_analysis(cache_key)
+    if cached is not None and is_cacheable_analysis(cached):
+        return cached
+    
+    request_params = build_chat_request(file_path, content_chunk, config, chunk_context)
+    analysis = await request_analysis(file_path, request_params, max_retries, retry_delay, full_max_tokens=config['model'].get('max_tokens', 1024))
+    if is_cacheable_analysis(analysis):
+        findings_db.cache_analysis(cache_key, analysis)
+    return analysis
+
+async def request_analysis(file_path, request_params, max_retries=5, retry_delay=2, key="issues", full_max_tokens=None):
+    """Send one chat request and parse the JSON reply (a list under key), retrying transient failures with backoff.
+    
+    A reply cut off at max_tokens is asked for once more with full_max_tokens, if given; one that is
+    still cut off comes back as a "truncated" error rather than whatever part of it parses.
+    """
     for attempt in range(max_retries):
         try:
-            # Build request params
-            request_params = {
-                "model": config['model']['name'],
-                "messages": [{"role": "user", "content": prompt}],
-                "temperature": temperature,
-                "max_tokens": max_tokens,
-                "timeout": 60.0
-            }
-            
-            # Add top_p if available
-            if top_p is not None:
-                request_params["top_p"] = top_p
+            async with request_slots.slot():
+                response = await client.chat.completions.create(**request_params, timeout=60.0)
             
-            response = client.chat.completions.create(**request_params)
+            if response.choices[0].finish_reason == "length":
+                if full_max_tokens and request_params['max_tokens'] < full_max_tokens and attempt < max_retries - 1:
+                    log_progress(f"⚠️  Reply for {file_path} hit max_tokens={request_params['max_tokens']}, retrying with {full_max_tokens}...")
+                    request_params['max_tokens'] = full_max_tokens
+                    continue
+                log_progress(f"⚠️  Reply for {file_path} was cut off at max_tokens={request_params['max_tokens']}")
+                return {"issues": [], "error": "truncated", "error_message": f"Reply exceeded max_tokens={request_params['max_tokens']}"}
             
             result = response.choices[0].message.content
-            candidate = extract_json_block(result) or result
-            parsed = try_parse_json(candidate)
+            parsed = parse_model_json(result, key)
             
-            # Self-repair if JSON parsing failed
-            if not parsed:
-                log_progress(f"⚠️  JSON parse failed for {file_path}, attempting self-repair...")
-                try:
-                    repair = client.chat.completions.create(
-                        model=config['model']['name'],
-                        messages=[
-                            {"role": "system", "content": "Return ONLY valid minified JSON. No code fences. No commentary."},
-                            {"role": "user", "content": f"Fix this to valid JSON matching schema {{'issues':[{{'type':'security|pattern|regression','severity':'high|medium|low','description':'','line_hint':'','cwe':''}}]}}:\n{candidate[:6000]}"}
-                        ],
-                        temperature=0.0,
-                        max_tokens=512,
-                        timeout=30.0
-                    )
-                    repaired = extract_json_block(repair.choices[0].message.content) or repair.choices[0].message.content
-                    parsed = try_parse_json(repaired)
-                except Exception as repair_error:
-                    log_progress(f"⚠️  Self-repair failed: {repair_error}")
+            # Ask again in plain JSON mode for servers that don't honour json_schema
+            if not parsed and request_params['response_format'] is not JSON_OBJECT_FORMAT and attempt < max_retries - 1:
+                log_progress(f"⚠️  JSON parse failed for {file_path}, retrying in JSON mode...")
+                request_params['response_format'] = JSON_OBJECT_FORMAT
+                continue
             
             if not parsed:
                 log_progress(f"⚠️  JSON decode error for {file_path}: model returned non-JSON.")
@@ -238,79 +818,64 @@ Code:
             
             return parsed
             
-        except APIConnectionError as e:
-            # Connection errors - retry with backoff
+        except (RateLimitError, InternalServerError, APIConnectionError) as e:
+            # Rate limits, 5xx, dropped connections and timeouts - retry with backoff
             if attempt < max_retries - 1:
-                wait_time = retry_delay * (2 ** attempt)  # Exponential backoff
-                log_progress(f"Connection error for {file_path} (attempt {attempt + 1}/{max_retries}). Retrying in {wait_time}s...")
-                time.sleep(wait_time)
+                wait_time = retry_wait(attempt, retry_delay)
+                log_progress(f"{type(e).__name__} for {file_path} (attempt {attempt + 1}/{max_retries}). Retrying in {wait_time:.1f}s...")
+                await asyncio.sleep(wait_time)
             else:
-                log_progress(f"❌ Connection error for {file_path} after {max_retries} attempts: {e}")
-                return {"issues": [], "error": "connection_failed", "error_message": str(e)}
-                
-        except APITimeoutError as e:
-            # Timeout errors - retry
-            if attempt < max_retries - 1:
-                wait_time = retry_delay * (2 ** attempt)
-                log_progress(f"Timeout error for {file_path} (attempt {attempt + 1}/{max_retries}). Retrying in {wait_time}s...")
-                time.sleep(wait_time)
-            else:
-                log_progress(f"❌ Timeout error for {file_path} after {max_retries} attempts: {e}")
-                return {"issues": [], "error": "timeout", "error_message": str(e)}
+                log_progress(f"❌ {type(e).__name__} for {file_path} after {max_retries} attempts: {e}")
+                raise TransientScanError(str(e)) from e
                 
         except APIError as e:
-            # Check for rate limits (429) or server busy (503)
-            error_str = str(e)
-            if '429' in error_str or '503' in error_str:
-                if attempt < max_retries - 1:
-                    wait_time = retry_delay * (2 ** attempt)
-                    log_progress(f"Rate limit/server busy for {file_path}. Retrying in {wait_time}s...")
-                    time.sleep(wait_time)
-                    continue
-            # Other API errors - log and return empty
+            # Other API errors (bad request, context too long) won't improve on retry
             log_progress(f"❌ API error for {file_path}: {e}")
             return {"issues": [], "error": "api_error", "error_message": str(e)}
-            
-        except Exception as e:
-            # Unexpected errors - log and return empty
-            log_progress(f"❌ Unexpected error analyzing {file_path}: {type(e).__name__}: {e}")
-            return {"issues": [], "error": "unknown_error", "error_message": str(e)}
     
     # Should never reach here, but just in case
-    return {"issues": []}
+    return {"issues": [], "error": "json_decode_error", "error_message": "Model returned non-JSON"}
 
-def scan_file(file_path, content, config, max_retries=3, retry_delay=2):
+async def scan_file(file_path, content, config, findings_db, max_retries=5, retry_delay=2):
     """Scan a file, handling chunking for large files"""
+    # Nothing worth sending to the model
+    if len(content.strip()) < MIN_SCAN_CHARS:
+        return {"issues": []}
+    
     # Extract file header/imports for context
-    lines = content.split('\n')
-    header_lines = []
-    for line in lines[:50]:  # First 50 lines typically have imports/header
-        if any(keyword in line for keyword in ['import', 'require', 'include', 'use', 'from', '#include', 'package']):
-            header_lines.append(line)
-    chunk_context = '\n'.join(header_lines) + '\n\n---\n\n' if header_lines else ''
+    chunk_context = extract_header_context(content)
     
     # Check if file needs chunking
-    chunks = split_code(content, max_chars=12000)
+    chunks = chunk_content(content, config)
     
     if len(chunks) == 1:
         # Single chunk - simple case
-        return scan_file_chunk(file_path, content, config, chunk_context, max_retries, retry_delay)
+        return await scan_file_chunk(file_path, chunks[0], config, findings_db, chunk_context, max_retries, retry_delay)
     
-    # Multiple chunks - process each and merge
+    # Multiple chunks - scan them concurrently (request_slots bounds the load) and merge in order
     log_progress(f"📦 Chunking {file_path} into {len(chunks)} parts")
     all_issues = []
     seen_keys = set()
     
-    for i, chunk in enumerate(chunks):
-        chunk_result = scan_file_chunk(
+    chunk_results = await asyncio.gather(*(
+        scan_file_chunk(
             f"{file_path} (chunk {i+1}/{len(chunks)})",
             chunk,
             config,
+            findings_db,
             chunk_context,
             max_retries,
             retry_delay
         )
-        
+        for i, chunk in enumerate(chunks)
+    ))
+    
+    merged = {"issues": all_issues}
+    for chunk_result in chunk_results:
+        # One failed chunk (truncated, non-JSON) means the file's issues are incomplete
+        if 'error' in chunk_result and 'error' not in merged:
+            merged['error'] = chunk_result['error']
+            merged['error_message'] = chunk_result.get('error_message', '')
         # Deduplicate issues
         for issue in chunk_result.get('issues', []):
             key = issue_key(issue)
@@ -318,235 +883,764 @@ def scan_file(file_path, content, config, max_retries=3, retry_delay=2):
                 seen_keys.add(key)
                 all_issues.append(issue)
     
-    return {"issues": all_issues}
+    return merged
+
+async def scan_small_files(files, config, findings_db, max_retries=5, retry_delay=2):
+    """Analyze several small (path, content) files in one request; returns {path: analysis}"""
+    results = {file_path: {"issues": []} for file_path, content in files if len(content.strip()) < MIN_SCAN_CHARS}
+    files = [(file_path, content) for file_path, content in files if file_path not in results]
+    if len(files) > 1:
+        log_progress(f"📦 Packing {len(files)} small files into one request")
+        label = f"{files[0][0]} (+{len(files) - 1} packed files)"
+        analysis = await request_analysis(label, build_files_request(files, config), max_retries, retry_delay, key="files")
+        paths = {file_path for file_path, content in files}
+        # A failed packed reply (e.g. truncated JSON) says nothing about each file; they fall through to single scans
+        if 'error' not in analysis:
+            for entry in analysis.get('files', []):
+                if isinstance(entry, dict) and entry.get('path') in paths:
+                    results[entry['path']] = {"issues": entry.get('issues', [])}
+    
+    # Files the model left out of its answer, a failed packed reply, or a lone small file are asked about one by one
+    missing = [(file_path, content) for file_path, content in files if file_path not in results]
+    analyses = await asyncio.gather(*(scan_file(file_path, content, config, findings_db, max_retries, retry_delay) for file_path, content in missing))
+    results.update(zip((file_path for file_path, content in missing), analyses))
+    return results
 
 def should_resume_from_folder(folder_path, state):
     """Determine if we should skip this folder (already completed)"""
-    if state['last_scanned_folder'] is None:
-        return True  # First run, start from beginning
-    
-    if folder_path in state['completed_folders']:
-        return False  # Already completed this folder
-    
-    # If this is the folder we were working on, resume from it
-    if state['last_scanned_folder'] and folder_path == state['last_scanned_folder']:
-        return True
-    
-    # If we haven't reached our last position yet, skip
-    if state['last_scanned_folder'] and folder_path < state['last_scanned_folder']:
+    # Every finished folder is in the set, so no walk-order position check is needed
+    return folder_path not in state['completed_folders']
+
+def is_source_file(file_name, extensions):
+    """Check extension (case-insensitive; extensions must be lowercased), skipping minified/bundled files"""
+    name = file_name.lower()
+    dot = name.rfind('.')
+    if dot < 0 or name[dot:] not in extensions:
         return False
-    
-    return True
+    return not name.endswith(('.min.js', '.min.css', '.map', '.bundle.js'))
 
-def should_resume_from_file(file_path, state):
-    """Determine if we should skip this file (already scanned in interrupted run)"""
-    if state['last_scanned_file'] is None:
-        return True
+def walk_files(root_dir, extensions, exclude_dirs):
+    """Depth-first walk yielding (folder, source file DirEntries) in sorted order.
     
-    # If we're past the last file we scanned, process this one
-    if file_path > state['last_scanned_file']:
-        return True
-    
-    return False
+    Uses os.scandir directly and hands back the DirEntry objects, so callers reuse
+    their cached type/stat info instead of re-stat'ing every path.
+    """
+    stack = [root_dir]
+    while stack:
+        folder = stack.pop()
+        dirs, files = [], []
+        try:
+            with os.scandir(folder) as it:
+                for entry in it:
+                    if entry.is_dir(follow_symlinks=False):
+                        if entry.name not in exclude_dirs:
+                            dirs.append(entry.path)
+                    # Name check first: it's free, while is_file() may stat (symlinks, DT_UNKNOWN filesystems)
+                    elif is_source_file(entry.name, extensions) and entry.is_file():
+                        files.append(entry)
+        except OSError as e:
+            log_progress(f"Skipped folder {folder}: {e}")
+            continue
+        
+        files.sort(key=lambda entry: entry.name)
+        yield folder, files
+        # Reverse so the stack pops subfolders in sorted order
+        stack.extend(sorted(dirs, reverse=True))
 
-def scan_repos(config):
-    """Walk through all repos and scan relevant files"""
-    root_dir = config['scan']['root_directory']
-    state = load_state()
-    findings_db = load_findings()
+def record_analysis(findings_db, file_path, file_hash, file_size, analysis, config, file_stat=None):
+    """Store one file's analysis result in findings_db, shared by every path with this content"""
+    # Store model metadata
+    model_meta = {
+        'model_name': config['model']['name'],
+        'temperature': config['model'].get('temperature', 0.1),
+        'max_tokens': config['model'].get('max_tokens', 1024),
+        'top_p': config['model'].get('top_p', 0.2)
+    }
     
-    # Initialize scan start time if first run
-    if state['scan_start_time'] is None:
-        state['scan_start_time'] = datetime.now().isoformat()
-        save_state(state)
+    entry = {
+        'scanned_at': datetime.now().isoformat(),
+        'file_size': file_size,
+        'findings': analysis.get('issues', []),
+        'model_meta': model_meta
+    }
     
-    log_progress(f"Starting scan from root: {root_dir}")
-    if state['last_scanned_folder']:
-        log_progress(f"Resuming from folder: {state['last_scanned_folder']}")
-        log_progress(f"Previous progress: {state['total_files_scanned']} files scanned, {state['total_files_skipped']} skipped")
+    # Track errors if any
+    if 'error' in analysis:
+        entry['scan_error'] = {
+            'type': analysis.get('error'),
+            'message': analysis.get('error_message', '')
+        }
     
-    extensions = set(config['scan']['extensions'])
-    exclude_dirs = set(config['scan']['exclude_dirs'])
+    findings_db.save_result(file_path, file_hash, entry, file_stat)
+
+def update_resume_folder(state, folder_pending):
+    """Point last_scanned_folder at the earliest walked folder that still has files in flight"""
+    for folder, remaining in folder_pending.items():  # dicts keep walk order
+        if remaining:
+            state['last_scanned_folder'] = folder
+            return
+    if folder_pending:
+        state['last_scanned_folder'] = next(reversed(folder_pending))
+
+def mark_folder_completed(folder, state, folder_pending):
+    state['completed_folders'].add(folder)
+    update_resume_folder(state, folder_pending)
+    append_completed_folder(folder)
+    log_progress(f"Completed folder: {folder}")
+
+def walk_producer(config, resume_state, findings_db, put):
+    """Walk the tree on a background thread, handing each folder's work to the scanner.
     
-    scanned_this_session = 0
-    skipped_this_session = 0
-    save_interval = config['scan']['save_interval']
+    Only reads findings_db; every update is left to the scanner on the event loop
+    thread. Puts (folder, to_scan, unchanged, rejected, skipped_count) per folder, then None.
+    """
+    extensions = {ext.lower() for ext in config['scan']['extensions']}
+    exclude_dirs = set(config['scan']['exclude_dirs'])
+    skip_patterns = config['scan'].get('skip_patterns', DEFAULT_SKIP_PATTERNS)
     
     try:
-        for root, dirs, files in os.walk(root_dir):
-            # Filter out excluded directories
-            dirs[:] = [d for d in dirs if d not in exclude_dirs]
-            dirs.sort()  # Sort for consistent ordering
-            
+        for root, entries in walk_files(config['scan']['root_directory'], extensions, exclude_dirs):
             # Check if we should skip this folder
-            if not should_resume_from_folder(root, state):
+            if not should_resume_from_folder(root, resume_state):
                 log_progress(f"Skipping completed folder: {root}")
                 continue
             
             log_progress(f"Processing folder: {root}")
-            state['last_scanned_folder'] = root
+            to_scan = []  # (file_path, file_hash, file_stat) needing LLM analysis
+            unchanged = []  # (file_path, file_hash, file_stat) whose content was analyzed before
+            rejected = []  # (file_path, reason, stat) not worth analyzing
+            skipped = 0
             
-            # Sort files for consistent ordering
-            files.sort()
-            
-            for file in files:
-                file_path = os.path.join(root, file)
-                
-                # Skip minified/bundled files
-                if file.endswith(('.min.js', '.min.css', '.map', '.bundle.js')):
-                    continue
-                
-                if Path(file_path).suffix not in extensions:
-                    continue
-                
-                # Check if we should resume from this file
-                if state['last_scanned_folder'] == root and not should_resume_from_file(file_path, state):
-                    continue
+            for entry in entries:
+                file_path = entry.path
                 
                 try:
-                    with open(file_path, 'r', encoding='utf-8', errors='ignore') as f:
-                        content = f.read()
+                    # Skip unchanged files without reading them in full
+                    st = entry.stat()
+                    if not should_scan_fast(file_path, st, findings_db):
+                        skipped += 1
+                        continue
                     
-                    # Skip binary files
-                    if looks_binary(content):
-                        log_progress(f"⚠️  Skipping binary file: {file_path}")
-                        skipped_this_session += 1
-                        state['total_files_skipped'] += 1
+                    sample = read_head(file_path, SNIFF_SIZE)
+                    
+                    # Skip binary, minified and generated files
+                    reason = skip_reason(entry.name, sample, skip_patterns)
+                    if reason:
+                        log_progress(f"⚠️  Skipping {reason} file: {file_path}")
+                        rejected.append((file_path, reason, st))
+                        skipped += 1
                         continue
                     
                     # Skip if already scanned this exact content
-                    if not should_scan(file_path, content, findings_db):
-                        skipped_this_session += 1
-                        state['total_files_skipped'] += 1
+                    file_stat = get_file_stat(st, sample[:HEAD_SAMPLE_SIZE])
+                    file_hash = get_file_hash(file_path, sample)
+                    if not should_scan(file_path, file_hash, findings_db):
+                        unchanged.append((file_path, file_hash, file_stat))
+                        skipped += 1
                         continue
                     
-                    log_progress(f"Scanning: {file_path}")
-                    analysis = scan_file(file_path, content, config)
-                    
-                    # Store model metadata
-                    model_meta = {
-                        'model_name': config['model']['name'],
-                        'temperature': config['model'].get('temperature', 0.1),
-                        'max_tokens': config['model'].get('max_tokens', 1024),
-                        'top_p': config['model'].get('top_p', 0.2)
-                    }
-                    
-                    findings_db[file_path] = {
-                        'hash': get_file_hash(content),
-                        'scanned_at': datetime.now().isoformat(),
-                        'file_size': len(content),
-                        'findings': analysis.get('issues', []),
-                        'model_meta': model_meta
-                    }
-                    
-                    # Track errors if any
-                    if 'error' in analysis:
-                        findings_db[file_path]['scan_error'] = {
-                            'type': analysis.get('error'),
-                            'message': analysis.get('error_message', '')
-                        }
-                    
-                    scanned_this_session += 1
-                    state['total_files_scanned'] += 1
-                    state['last_scanned_file'] = file_path
-                    
-                    # Periodic save
-                    if scanned_this_session % save_interval == 0:
-                        save_findings(findings_db)
-                        save_state(state)
-                        log_progress(f"Progress checkpoint: {state['total_files_scanned']} total files scanned")
+                    to_scan.append((file_path, file_hash, file_stat))
                     
                 except Exception as e:
                     log_progress(f"Skipped {file_path}: {e}")
             
-            # Mark folder as completed
-            state['completed_folders'].append(root)
-            save_state(state)
-            log_progress(f"Completed folder: {root}")
+            put((root, to_scan, unchanged, rejected, skipped))
+    except Exception as e:
+        log_progress(f"❌ Directory walk failed: {type(e).__name__}: {e}")
+    finally:
+        put(None)
+
+async def scan_pending(folder_pending, config, state, findings_db, stats):
+    """Analyze files as the background walker finds them, keeping at most max_concurrency requests in flight"""
+    loop = asyncio.get_running_loop()
+    work = asyncio.Queue(maxsize=WORK_QUEUE_SIZE)
+    sem = asyncio.Semaphore(config['scan'].get('max_concurrency', 8))
+    save_interval = config['scan']['save_interval']
+    tasks = set()
+    failed_folders = set()  # Folders with a file that must be retried next run
+    session_cache = {}  # content hash -> future of its analysis, so identical files in flight share one LLM call
+    io_pool = ThreadPoolExecutor(max_workers=READ_WORKERS, thread_name_prefix="read")
+    
+    def put(item):
+        # Blocks the walker thread while the queue is full
+        asyncio.run_coroutine_threadsafe(work.put(item), loop).result()
+    
+    # Snapshot resume info so the walker isn't affected by progress made during this run
+    resume_state = {'completed_folders': set(state['completed_folders'])}
+    threading.Thread(target=walk_producer, args=(config, resume_state, findings_db, put), daemon=True).start()
+    
+    packed = []  # Small files waiting to share one request: (folder, file_path, file_hash, file_stat, source)
+    packed_chars = 0
+    
+    def spawn(coro):
+        task = asyncio.create_task(coro)
+        tasks.add(task)
+        task.add_done_callback(tasks.discard)
+    
+    async def scan_one(folder, file_path, file_hash, file_stat, source):
+        pending = session_cache.get(file_hash)
+        content = analysis = None  # analysis stays None if cancelled by Ctrl+C, releasing waiters on this content
+        if pending is not None:
+            # Same content as a file already analyzed this run - reuse its result
+            source.cancel()
+            sem.release()
+            if await pending is None:
+                failed_folders.add(folder)
+            else:
+                log_progress(f"Reusing analysis of identical content: {file_path}")
+                findings_db.link_path(file_path, file_hash, file_stat)
+                stats['skipped'] += 1
+                state['total_files_skipped'] += 1
+        else:
+            pending = session_cache[file_hash] = loop.create_future()
+            try:
+                log_progress(f"Scanning: {file_path}")
+                content = await source
+                analysis = await scan_file(file_path, content, config, findings_db)
+            except Exception as e:
+                log_progress(f"Skipped {file_path}: {e}")
+                failed_folders.add(folder)
+            finally:
+                sem.release()
+                pending.set_result(analysis)
+        
+        finish_file(folder, file_path, file_hash, file_stat, content, analysis)
+    
+    async def scan_packed(batch):
+        contents, results = [None] * len(batch), {}
+        try:
+            for folder, file_path, file_hash, file_stat, source in batch:
+                log_progress(f"Scanning: {file_path}")
+            contents = await asyncio.gather(*(source for *_, source in batch))
+            results = await scan_small_files([(entry[1], content) for entry, content in zip(batch, contents)], config, findings_db)
+        except Exception as e:
+            log_progress(f"Skipped {len(batch)} packed files: {e}")
+        finally:
+            sem.release()
+            for folder, file_path, file_hash, file_stat, source in batch:
+                if results.get(file_path) is None:
+                    failed_folders.add(folder)
+                session_cache[file_hash].set_result(results.get(file_path))
+        
+        for (folder, file_path, file_hash, file_stat, source), content in zip(batch, contents):
+            finish_file(folder, file_path, file_hash, file_stat, content, results.get(file_path))
+    
+    async def flush_packed():
+        nonlocal packed, packed_chars
+        if packed:
+            await sem.acquire()
+            spawn(scan_packed(packed))
+            packed, packed_chars = [], 0
+    
+    def finish_file(folder, file_path, file_hash, file_stat, content, analysis):
+        # Runs outside the callers' try blocks; an error here must not leave the folder pending forever
+        try:
+            if analysis is not None:
+                record_analysis(findings_db, file_path, file_hash, len(content), analysis, config, file_stat)
+                stats['scanned'] += 1
+                state['total_files_scanned'] += 1
+                state['last_scanned_file'] = file_path
+                
+                # Periodic save (findings are already committed per file)
+                if stats['scanned'] % save_interval == 0:
+                    update_resume_folder(state, folder_pending)
+                    save_state(state)
+                    log_progress(f"Progress checkpoint: {state['total_files_scanned']} total files scanned")
+        except Exception as e:
+            log_progress(f"Skipped {file_path}: {type(e).__name__}: {e}")
+            failed_folders.add(folder)
+        
+        folder_pending[folder] -= 1
+        if folder_pending[folder] == 0:
+            if folder in failed_folders:
+                log_progress(f"Folder left incomplete, failed files will be retried next run: {folder}")
+            else:
+                mark_folder_completed(folder, state, folder_pending)
+    
+    while True:
+        # Don't hold packed small files back while the walker is still busy finding more
+        if work.empty():
+            await flush_packed()
+        if (item := await work.get()) is None:
+            break
+        folder, to_scan, unchanged, rejected, skipped = item
+        folder_pending[folder] = len(to_scan)
+        
+        for file_path, file_hash, file_stat in unchanged:
+            findings_db.link_path(file_path, file_hash, file_stat)
+        for file_path, reason, st in rejected:
+            findings_db.mark_skipped(file_path, reason, st)
+        stats['skipped'] += skipped
+        state['total_files_skipped'] += skipped
+        
+        # Folders with nothing left to analyze are done already
+        if not to_scan:
+            mark_folder_completed(folder, state, folder_pending)
+            continue
+        
+        for file_path, file_hash, file_stat in to_scan:
+            # Start reading before waiting for a slot, so the file is in memory when one frees up
+            source = loop.run_in_executor(io_pool, read_source, file_path)
+            
+            # Small files share a request; identical content already in flight goes through scan_one to reuse it
+            if file_stat['size'] < SMALL_FILE_CHARS and file_hash not in session_cache:
+                if packed_chars + file_stat['size'] > MAX_PACKED_CHARS:
+                    await flush_packed()
+                session_cache[file_hash] = loop.create_future()
+                packed.append((folder, file_path, file_hash, file_stat, source))
+                packed_chars += file_stat['size']
+                if len(packed) >= FILES_PER_REQUEST:
+                    await flush_packed()
+                continue
+            
+            await sem.acquire()
+            spawn(scan_one(folder, file_path, file_hash, file_stat, source))
+    
+    await flush_packed()
+    if tasks:
+        await asyncio.gather(*tasks)
+    io_pool.shutdown()
+
+def scan_repos(config):
+    """Walk the tree on a background thread while scanning the files that need it concurrently"""
+    root_dir = config['scan']['root_directory']
+    state = load_state()
+    findings_db = load_findings()
+    
+    # Initialize scan start time if first run
+    if state['scan_start_time'] is None:
+        state['scan_start_time'] = datetime.now().isoformat()
+        save_state(state)
+    
+    log_progress(f"Starting scan from root: {root_dir}")
+    if state['last_scanned_folder']:
+        log_progress(f"Resuming from folder: {state['last_scanned_folder']}")
+        log_progress(f"Previous progress: {state['total_files_scanned']} files scanned, {state['total_files_skipped']} skipped")
+    
+    stats = {'scanned': 0, 'skipped': 0}
+    folder_pending = {}  # folder -> files still awaiting analysis, in walk order
+    
+    try:
+        log_progress(f"Scanning with up to {config['scan'].get('max_concurrency', 8)} concurrent requests")
+        asyncio.run(run_with_client(scan_pending(folder_pending, config, state, findings_db, stats)))
     
     except KeyboardInterrupt:
         log_progress("\n⚠️  Scan interrupted by user")
-        save_findings(findings_db)
+        update_resume_folder(state, folder_pending)
         save_state(state)
         log_progress(f"State saved. Resume anytime by running the script again.")
-        log_progress(f"Session stats: {scanned_this_session} scanned, {skipped_this_session} skipped")
+        log_progress(f"Session stats: {stats['scanned']} scanned, {stats['skipped']} skipped")
         return findings_db
     
     # Scan completed successfully
     state['last_run'] = datetime.now().isoformat()
-    save_findings(findings_db)
     save_state(state)
     
     log_progress(f"\n✅ Scan completed!")
     log_progress(f"Total files scanned: {state['total_files_scanned']}")
     log_progress(f"Total files skipped: {state['total_files_skipped']}")
-    log_progress(f"Session stats: {scanned_this_session} scanned, {skipped_this_session} skipped")
+    log_progress(f"Session stats: {stats['scanned']} scanned, {stats['skipped']} skipped")
     
     return findings_db
 
+def collect_batch_requests(config, findings_db):
+    """Walk the tree and build one batch request line per chunk of every file needing a scan"""
+    extensions = {ext.lower() for ext in config['scan']['extensions']}
+    exclude_dirs = set(config['scan']['exclude_dirs'])
+    skip_patterns = config['scan'].get('skip_patterns', DEFAULT_SKIP_PATTERNS)
+    lines = []
+    files = {}
+    requested = {}  # content hash -> first path sent for it in this batch
+    
+    for root, entries in walk_files(config['scan']['root_directory'], extensions, exclude_dirs):
+        for entry in entries:
+            file_path = entry.path
+            try:
+                st = entry.stat()
+                if not should_scan_fast(file_path, st, findings_db):
+                    continue
+                sample = read_head(file_path, SNIFF_SIZE)
+                reason = skip_reason(entry.name, sample, skip_patterns)
+                if reason:
+                    findings_db.mark_skipped(file_path, reason, st)
+                    continue
+                file_stat = get_file_stat(st, sample[:HEAD_SAMPLE_SIZE])
+                file_hash = get_file_hash(file_path, sample)
+                if not should_scan(file_path, file_hash, findings_db):
+                    findings_db.link_path(file_path, file_hash, file_stat)
+                    continue
+                if file_hash in requested:
+                    # Identical content is already in this batch; link it once results arrive
+                    files[file_path] = {'hash': file_hash, 'size': st.st_size, 'stat': file_stat, 'same_as': requested[file_hash]}
+                    continue
+                content = read_source(file_path)
+            except OSError as e:
+                log_progress(f"Skipped {file_path}: {e}")
+                continue
+            
+            if len(content.strip()) < MIN_SCAN_CHARS:
+                record_analysis(findings_db, file_path, file_hash, len(content), {"issues": []}, config, file_stat)
+                continue
+            
+            chunk_context = extract_header_context(content)
+            chunks = chunk_content(content, config)
+            for i, chunk in enumerate(chunks):
+                label = file_path if len(chunks) == 1 else f"{file_path} (chunk {i+1}/{len(chunks)})"
+                lines.append(orjson.dumps({
+                    "custom_id": f"{file_path}#{i}",
+                    "method": "POST",
+                    "url": "/v1/chat/completions",
+                    "body": build_chat_request(label, chunk, config, chunk_context)
+                }).decode())
+            files[file_path] = {'hash': file_hash, 'size': len(content), 'stat': file_stat, 'chunks': len(chunks)}
+            requested[file_hash] = file_path
+    
+    return lines, files
+
+def is_transient_status(status_code):
+    """Batch line statuses worth retrying on a later run (rate limit, timeout, server error)"""
+    return status_code is None or status_code in (408, 409, 429) or status_code >= 500
+
+def parse_batch_output(text, batch_files):
+    """Merge batch output lines into one analysis per file, deduplicating chunk issues.
+    
+    Files with a chunk that failed transiently or is missing from the output are left out,
+    so they are not recorded and get rescanned.
+    """
+    analyses = {file_path: {"issues": []} for file_path, info in batch_files.items() if 'same_as' not in info}
+    seen_keys = {file_path: set() for file_path in analyses}
+    answered = {file_path: set() for file_path in analyses}  # Chunk indices with a line in the output
+    retry = set()
+    
+    for line in text.splitlines():
+        if not line.strip():
+            continue
+        item = orjson.loads(line)
+        file_path, _, chunk_index = item['custom_id'].rpartition('#')
+        if file_path not in analyses:
+            continue
+        analysis = analyses[file_path]
+        answered[file_path].add(chunk_index)
+        
+        response = item.get('response') or {}
+        status_code = response.get('status_code')
+        if item.get('error') or status_code != 200:
+            # Error-file lines carry no status; like 429s and 5xx they may succeed next time
+            if is_transient_status(status_code):
+                retry.add(file_path)
+                continue
+            analysis['error'] = "api_error"
+            analysis['error_message'] = str(item.get('error') or response.get('body'))
+            continue
+        
+        choice = response['body']['choices'][0]
+        if choice.get('finish_reason') == "length":
+            analysis['error'] = "truncated"
+            analysis['error_message'] = "Reply exceeded max_tokens"
+            continue
+        result = choice['message']['content']
+        parsed = parse_model_json(result)
+        if not parsed:
+            analysis['error'] = "json_decode_error"
+            analysis['error_message'] = "Model returned non-JSON"
+            continue
+        
+        for issue in parsed.get('issues', []):
+            key = issue_key(issue)
+            if key not in seen_keys[file_path]:
+                seen_keys[file_path].add(key)
+                analysis['issues'].append(issue)
+    
+    # Every chunk must have answered; batches submitted before chunk counts were stored can only be checked for one
+    retry.update(file_path for file_path in analyses if len(answered[file_path]) < batch_files[file_path].get('chunks', 1))
+    if retry:
+        log_progress(f"⚠️  {len(retry)} files hit transient errors or are missing from the batch output and will be rescanned next run")
+    for file_path in retry:
+        del analyses[file_path]
+    return analyses
+
+async def run_batch(config, state, findings_db):
+    """Submit (or resume) a provider batch job and ingest its results into findings_db"""
+    batch_state = state.get('batch')
+    
+    if batch_state is None:
+        lines, batch_files = collect_batch_requests(config, findings_db)
+        if not lines:
+            log_progress("Nothing to scan - all files are up to date.")
+            return
+        
+        with open(BATCH_INPUT_FILE, 'w') as f:
+            f.write('\n'.join(lines) + '\n')
+        with open(BATCH_INPUT_FILE, 'rb') as f:
+            input_file = await client.files.create(file=f, purpose="batch")
+        batch = await client.batches.create(
+            input_file_id=input_file.id,
+            endpoint="/v1/chat/completions",
+            completion_window="24h"
+        )
+        
+        batch_state = {
+            'id': batch.id,
+            'submitted_at': datetime.now().isoformat(),
+            'files': batch_files
+        }
+        state['batch'] = batch_state
+        save_state(state)
+        log_progress(f"Submitted batch {batch.id}: {len(lines)} requests for {len(batch_files)} files")
+    else:
+        log_progress(f"Resuming batch {batch_state['id']} submitted at {batch_state['submitted_at']}")
+    
+    poll_interval = config['scan'].get('batch_poll_interval', 60)
+    while True:
+        batch = await client.batches.retrieve(batch_state['id'])
+        if batch.status in ('completed', 'failed', 'expired', 'cancelled'):
+            break
+        log_progress(f"Batch {batch.id} is {batch.status}, checking again in {poll_interval}s...")
+        await asyncio.sleep(poll_interval)
+    
+    if batch.status != 'completed':
+        log_progress(f"❌ Batch {batch.id} ended with status: {batch.status}")
+        state['batch'] = None
+        save_state(state)
+        return
+    
+    output = ""
+    for file_id in (batch.output_file_id, batch.error_file_id):
+        if file_id:
+            output += (await client.files.content(file_id)).text + "\n"
+    
+    analyses = parse_batch_output(output, batch_state['files'])
+    for file_path, analysis in analyses.items():
+        file_info = batch_state['files'][file_path]
+        record_analysis(findings_db, file_path, file_info['hash'], file_info['size'], analysis, config, file_info.get('stat'))
+    for file_path, file_info in batch_state['files'].items():
+        if file_info.get('same_as') in analyses:
+            findings_db.link_path(file_path, file_info['hash'], file_info.get('stat'))
+    
+    state['total_files_scanned'] += len(analyses)
+    state['batch'] = None
+    state['last_run'] = datetime.now().isoformat()
+    save_state(state)
+    log_progress(f"✅ Batch {batch.id} ingested: {len(analyses)} files")
+
+def batch_scan_repos(config):
+    """Scan all changed files through the provider's Batch API instead of live requests"""
+    state = load_state()
+    findings_db = load_findings()
+    
+    if state['scan_start_time'] is None:
+        state['scan_start_time'] = datetime.now().isoformat()
+        save_state(state)
+    
+    try:
+        asyncio.run(run_with_client(run_batch(config, state, findings_db)))
+    except KeyboardInterrupt:
+        log_progress("\n⚠️  Stopped waiting for batch. Run 'batch' again to resume polling.")
+    
+    return findings_db
+
+def write_section(fh, title, parts_by_file, empty_message):
+    """Write one severity section, one block per file in path order"""
+    fh.write(title)
+    if not parts_by_file:
+        fh.write(empty_message)
+        return
+    for file_path, (fragment, text) in sorted(parts_by_file.items()):
+        if fragment is None:
+            fh.write(text)
+            continue
+        with open(fragment) as src:
+            shutil.copyfileobj(src, fh)
+
+def write_high_issues(fh, file_path, file_issues, scanned_at):
+    fh.write(f"\n### 📄 {file_path}\n\n")
+    fh.write(f"*Scanned: {scanned_at} | {len(file_issues)} issue(s)*\n\n")
+    
+    for idx, issue in enumerate(file_issues, 1):
+        fh.write(f"#### Issue #{idx}: {issue.get('type', 'unknown').upper()}\n\n")
+        if issue.get('cwe'):
+            fh.write(f"**CWE:** {issue['cwe']}\n\n")
+        fh.write(f"{issue['description']}\n\n")
+        if issue.get('line_hint'):
+            fh.write(f"**Code Snippet:**\n```\n{issue['line_hint']}\n```\n\n")
+        fh.write("---\n\n")
+
+def write_medium_issues(fh, file_path, file_issues):
+    fh.write(f"\n### 📄 {file_path}\n\n")
+    fh.write(f"*{len(file_issues)} issue(s)*\n\n")
+    
+    for issue in file_issues:
+        cwe_str = f" [{issue['cwe']}]" if issue.get('cwe') else ""
+        fh.write(f"**{issue.get('type', 'unknown').upper()}{cwe_str}:** {issue['description']}\n")
+        if issue.get('line_hint'):
+            fh.write(f"\n```\n{issue['line_hint']}\n```\n")
+        fh.write("\n")
+
+def write_low_issues(fh, file_path, file_issues):
+    # Compact list for low priority
+    fh.write(f"\n**{file_path}** ({len(file_issues)} issue(s)):\n")
+    for issue in file_issues:
+        fh.write(f"- *{issue.get('type', 'unknown')}*: {issue['description']}\n")
+    fh.write("\n")
+
+def render_issues(file_path, issues, scanned_at):
+    """Render one file's issues as {severity: markdown}, in the layout of each severity section"""
+    by_severity = defaultdict(list)
+    for issue in issues:
+        by_severity[issue['severity'] if issue['severity'] in ('high', 'medium') else 'low'].append(issue)
+    
+    rendered = {}
+    for severity, file_issues in by_severity.items():
+        fh = io.StringIO()
+        if severity == 'high':
+            write_high_issues(fh, file_path, file_issues, scanned_at)
+        elif severity == 'medium':
+            write_medium_issues(fh, file_path, file_issues)
+        else:
+            write_low_issues(fh, file_path, file_issues)
+        rendered[severity] = fh.getvalue()
+    return rendered
+
+def dedupe_issues(findings):
+    """(position, key, issue) for the first occurrence of each issue key in findings"""
+    kept = []
+    seen_keys = set()
+    for position, issue in enumerate(findings):
+        key = issue_key(issue)
+        if key not in seen_keys:
+            seen_keys.add(key)
+            kept.append((position, key, issue))
+    return kept
+
+def build_report_fragment(file_path, file_hash, entry):
+    """Render a file's report sections to REPORT_FRAGMENT_DIR and return its index record"""
+    scanned_at = entry.get('scanned_at', 'unknown')
+    findings = entry.get('findings', [])
+    keyed_issues = dedupe_issues(findings)
+    issues = [issue for _, _, issue in keyed_issues]
+    
+    types = defaultdict(lambda: defaultdict(int))
+    for issue in findings:
+        # Type breakdown counts every reported issue, duplicates included
+        types[issue.get('type', 'unknown')][issue['severity']] += 1
+    
+    fragment = os.path.join(REPORT_FRAGMENT_DIR, hashlib.sha256(file_path.encode()).hexdigest())
+    rendered = render_issues(file_path, issues, scanned_at)
+    for severity in ('high', 'medium', 'low'):
+        part = f"{fragment}.{severity}.md"
+        if severity in rendered:
+            with open(part, 'w') as fh:
+                fh.write(rendered[severity])
+        elif os.path.exists(part):
+            os.remove(part)
+    
+    return {
+        'hash': file_hash,
+        'scanned_at': scanned_at,
+        'fragment': fragment,
+        # Keys are hashed once here; later reports dedupe across files from the index alone
+        'issues': [
+            [key, issue['severity'] if issue['severity'] in ('high', 'medium') else 'low', position]
+            for position, key, issue in keyed_issues
+        ],
+        'types': types,
+        'scan_error': entry.get('scan_error')
+    }
+
+def load_report_index():
+    """Index of pre-rendered fragments: path -> hash, scanned_at, issue keys and counts"""
+    try:
+        with open(REPORT_INDEX, 'rb') as f:
+            index = orjson.loads(f.read())
+    except (OSError, orjson.JSONDecodeError):
+        return {}
+    if index.get('version') == REPORT_INDEX_VERSION:
+        return index['files']
+    # Older layout (the first one was a bare path -> record dict): keep records only so
+    # their fragments get re-rendered or cleaned up
+    return {file_path: {**record, 'hash': None} for file_path, record in index.get('files', index).items()}
+
+def remove_report_fragments(record):
+    for severity in ('high', 'medium', 'low'):
+        part = f"{record['fragment']}.{severity}.md"
+        if os.path.exists(part):
+            os.remove(part)
+
 def generate_report(findings_db):
-    """Create a comprehensive, readable report"""
-    # Organize issues by severity
-    high_priority = []
-    medium_priority = []
-    low_priority = []
+    """Create a comprehensive, readable report, streamed straight to the report file"""
+    # Organize issues by severity, grouped by file, in a single pass
+    parts = {'high': {}, 'medium': {}, 'low': {}}
+    severity_counts = {'high': 0, 'medium': 0, 'low': 0}
+    issue_types = defaultdict(lambda: {'high': 0, 'medium': 0, 'low': 0})
     
     # Also organize by file for file-by-file view
     files_with_issues = {}
     files_clean = []
     files_with_errors = []
     
+    total_files = findings_db.count_files()
     total_issues = 0
     seen_issue_keys = set()  # Global deduplication across files
     
-    for file_path, data in findings_db.items():
+    # Only files whose analysis changed since the last report get re-rendered
+    os.makedirs(REPORT_FRAGMENT_DIR, exist_ok=True)
+    old_index = load_report_index()
+    index = {}
+    
+    for file_path, file_hash, scanned_at in findings_db.iter_file_hashes():
+        record = old_index.pop(file_path, None)
+        if record is None or record['hash'] != file_hash or record['scanned_at'] != scanned_at:
+            record = build_report_fragment(file_path, file_hash, findings_db.get_result(file_hash))
+        index[file_path] = record
+        
         # Check for scan errors
-        if 'scan_error' in data:
+        if record['scan_error']:
             files_with_errors.append({
                 'file': file_path,
-                'error_type': data['scan_error'].get('type', 'unknown'),
-                'error_message': data['scan_error'].get('message', ''),
-                'scanned_at': data.get('scanned_at', 'unknown')
+                'error_type': record['scan_error'].get('type', 'unknown'),
+                'error_message': record['scan_error'].get('message', ''),
+                'scanned_at': record['scanned_at']
             })
         
-        findings = data.get('findings', [])
-        if not findings:
+        if not record['issues']:
             files_clean.append(file_path)
             continue
         
         files_with_issues[file_path] = {
-            'findings': findings,
-            'scanned_at': data.get('scanned_at', 'unknown'),
-            'file_size': data.get('file_size', 0),
+            'scanned_at': record['scanned_at'],
             'high_count': 0,
             'medium_count': 0,
             'low_count': 0
         }
+        for issue_type, counts in record['types'].items():
+            for severity, count in counts.items():
+                issue_types[issue_type][severity] += count
         
-        # Deduplicate issues within file and across files
-        for issue in findings:
-            issue_key_hash = issue_key(issue)
-            if issue_key_hash in seen_issue_keys:
-                continue  # Skip duplicate
-            seen_issue_keys.add(issue_key_hash)
-            
-            issue_copy = issue.copy()
-            issue_copy['file'] = file_path
-            issue_copy['scanned_at'] = data.get('scanned_at', 'unknown')
-            total_issues += 1
-            
-            if issue['severity'] == 'high':
-                high_priority.append(issue_copy)
-                files_with_issues[file_path]['high_count'] += 1
-            elif issue['severity'] == 'medium':
-                medium_priority.append(issue_copy)
-                files_with_issues[file_path]['medium_count'] += 1
-            else:
-                low_priority.append(issue_copy)
-                files_with_issues[file_path]['low_count'] += 1
+        # Deduplicate issues across files
+        kept = [(key, severity, position) for key, severity, position in record['issues'] if key not in seen_issue_keys]
+        seen_issue_keys.update(key for key, _, _ in record['issues'])
+        total_issues += len(kept)
+        for _, severity, _ in kept:
+            severity_counts[severity] += 1
+            files_with_issues[file_path][f'{severity}_count'] += 1
+        
+        if len(kept) == len(record['issues']):
+            for severity in {severity for _, severity, _ in kept}:
+                parts[severity][file_path] = (f"{record['fragment']}.{severity}.md", None)
+        elif kept:
+            # Some issues were already reported for another file; render just the rest
+            entry = findings_db.get_result(file_hash)
+            issues = [entry['findings'][position] for _, _, position in kept]
+            for severity, text in render_issues(file_path, issues, record['scanned_at']).items():
+                parts[severity][file_path] = (None, text)
     
-    # Generate report
-    report = f"""# Code Analysis Report
+    # Drop fragments of files no longer in the findings database
+    for record in old_index.values():
+        remove_report_fragments(record)
+    atomic_write(REPORT_INDEX, orjson.dumps({'version': REPORT_INDEX_VERSION, 'files': index}))
+    
+    with open(REPORT_FILE, 'w', buffering=1 << 20) as fh:
+        fh.write(f"""# Code Analysis Report
 
 **Generated:** {datetime.now().strftime('%Y-%m-%d %H:%M:%S')}
 
@@ -556,135 +1650,69 @@ def generate_report(findings_db):
 
 | Metric | Count |
 |--------|-------|
-| **Total Files Analyzed** | {len(findings_db):,} |
+| **Total Files Analyzed** | {total_files:,} |
 | **Files with Issues** | {len(files_with_issues):,} |
 | **Clean Files** | {len(files_clean):,} |
 | **Total Issues Found** | {total_issues:,} |
-| **🔴 High Priority** | {len(high_priority):,} |
-| **🟡 Medium Priority** | {len(medium_priority):,} |
-| **🟢 Low Priority** | {len(low_priority):,} |
+| **🔴 High Priority** | {severity_counts['high']:,} |
+| **🟡 Medium Priority** | {severity_counts['medium']:,} |
+| **🟢 Low Priority** | {severity_counts['low']:,} |
 | **⚠️ Files with Scan Errors** | {len(files_with_errors):,} |
 
-**Issue Rate:** {(len(files_with_issues) / len(findings_db) * 100) if len(findings_db) > 0 else 0:.1f}% of files have issues
+**Issue Rate:** {(len(files_with_issues) / total_files * 100) if total_files > 0 else 0:.1f}% of files have issues
 
 ---
 
-## 🔴 High Priority Issues ({len(high_priority)})
-
-"""
-    
-    if high_priority:
-        # Group by file for better readability
-        issues_by_file = {}
-        for issue in high_priority:
-            file_path = issue['file']
-            if file_path not in issues_by_file:
-                issues_by_file[file_path] = []
-            issues_by_file[file_path].append(issue)
+""")
         
-        for file_path, file_issues in sorted(issues_by_file.items()):
-            report += f"\n### 📄 {file_path}\n\n"
-            report += f"*Scanned: {file_issues[0]['scanned_at']} | {len(file_issues)} issue(s)*\n\n"
-            
-            for idx, issue in enumerate(file_issues, 1):
-                report += f"#### Issue #{idx}: {issue.get('type', 'unknown').upper()}\n\n"
-                if issue.get('cwe'):
-                    report += f"**CWE:** {issue['cwe']}\n\n"
-                report += f"{issue['description']}\n\n"
-                if issue.get('line_hint'):
-                    report += f"**Code Snippet:**\n```\n{issue['line_hint']}\n```\n\n"
-                report += "---\n\n"
-    else:
-        report += "✅ **No high priority issues found!**\n\n"
-    
-    report += f"\n## 🟡 Medium Priority Issues ({len(medium_priority)})\n\n"
-    
-    if medium_priority:
-        issues_by_file = {}
-        for issue in medium_priority:
-            file_path = issue['file']
-            if file_path not in issues_by_file:
-                issues_by_file[file_path] = []
-            issues_by_file[file_path].append(issue)
+        write_section(
+            fh, f"## 🔴 High Priority Issues ({severity_counts['high']})\n\n", parts['high'],
+            "✅ **No high priority issues found!**\n\n"
+        )
+        write_section(
+            fh, f"\n## 🟡 Medium Priority Issues ({severity_counts['medium']})\n\n", parts['medium'],
+            "✅ **No medium priority issues found!**\n\n"
+        )
+        write_section(
+            fh, f"\n## 🟢 Low Priority Issues ({severity_counts['low']})\n\n", parts['low'],
+            "✅ **No low priority issues found!**\n\n"
+        )
         
-        for file_path, file_issues in sorted(issues_by_file.items()):
-            report += f"\n### 📄 {file_path}\n\n"
-            report += f"*{len(file_issues)} issue(s)*\n\n"
-            
-            for idx, issue in enumerate(file_issues, 1):
-                cwe_str = f" [{issue['cwe']}]" if issue.get('cwe') else ""
-                report += f"**{issue.get('type', 'unknown').upper()}{cwe_str}:** {issue['description']}\n"
-                if issue.get('line_hint'):
-                    report += f"\n```\n{issue['line_hint']}\n```\n"
-                report += "\n"
-    else:
-        report += "✅ **No medium priority issues found!**\n\n"
-    
-    report += f"\n## 🟢 Low Priority Issues ({len(low_priority)})\n\n"
-    
-    if low_priority:
-        # Group low priority by file for compactness
-        issues_by_file = {}
-        for issue in low_priority:
-            file_path = issue['file']
-            if file_path not in issues_by_file:
-                issues_by_file[file_path] = []
-            issues_by_file[file_path].append(issue)
+        # Add file-by-file summary
+        fh.write(f"\n---\n\n## 📁 Files with Issues (Summary)\n\n")
+        fh.write("| File | High | Medium | Low | Total | Scanned At |\n")
+        fh.write("|------|------|--------|-----|-------|------------|\n")
         
-        for file_path, file_issues in sorted(issues_by_file.items()):
-            report += f"\n**{file_path}** ({len(file_issues)} issue(s)):\n"
-            for issue in file_issues:
-                report += f"- *{issue.get('type', 'unknown')}*: {issue['description']}\n"
-            report += "\n"
-    else:
-        report += "✅ **No low priority issues found!**\n\n"
-    
-    # Add file-by-file summary
-    report += f"\n---\n\n## 📁 Files with Issues (Summary)\n\n"
-    report += "| File | High | Medium | Low | Total | Scanned At |\n"
-    report += "|------|------|--------|-----|-------|------------|\n"
-    
-    for file_path, file_data in sorted(files_with_issues.items()):
-        total = file_data['high_count'] + file_data['medium_count'] + file_data['low_count']
-        scanned = file_data['scanned_at'].split('T')[0] if 'T' in file_data['scanned_at'] else file_data['scanned_at']
-        report += f"| `{file_path}` | {file_data['high_count']} | {file_data['medium_count']} | {file_data['low_count']} | **{total}** | {scanned} |\n"
-    
-    # Add issue type breakdown
-    issue_types = {}
-    for file_path, data in findings_db.items():
-        for issue in data.get('findings', []):
-            issue_type = issue.get('type', 'unknown')
-            if issue_type not in issue_types:
-                issue_types[issue_type] = {'high': 0, 'medium': 0, 'low': 0}
-            issue_types[issue_type][issue['severity']] += 1
-    
-    if issue_types:
-        report += f"\n---\n\n## 📈 Issue Type Breakdown\n\n"
-        report += "| Type | High | Medium | Low | Total |\n"
-        report += "|------|------|--------|-----|-------|\n"
-        for issue_type, counts in sorted(issue_types.items()):
-            total = counts['high'] + counts['medium'] + counts['low']
-            report += f"| {issue_type} | {counts['high']} | {counts['medium']} | {counts['low']} | **{total}** |\n"
-    
-    # Add section for files with scan errors
-    if files_with_errors:
-        report += f"\n---\n\n## ⚠️ Files with Scan Errors ({len(files_with_errors)})\n\n"
-        report += "These files encountered errors during scanning and may need to be rescanned:\n\n"
-        report += "| File | Error Type | Error Message | Scanned At |\n"
-        report += "|------|------------|---------------|------------|\n"
-        for error_info in files_with_errors:
-            file_path = error_info['file']
-            error_type = error_info['error_type']
-            error_msg = error_info['error_message'][:100] + "..." if len(error_info['error_message']) > 100 else error_info['error_message']
-            scanned = error_info['scanned_at'].split('T')[0] if 'T' in error_info['scanned_at'] else error_info['scanned_at']
-            report += f"| `{file_path}` | {error_type} | {error_msg} | {scanned} |\n"
-        report += f"\n💡 **Tip:** Files with connection errors can be rescanned by deleting their entry from `code_analysis_findings.json` or running the scanner again (it will skip unchanged files).\n\n"
-    
-    with open('code_analysis_report.md', 'w') as f:
-        f.write(report)
-    
-    log_progress(f"\n✅ Report saved to code_analysis_report.md")
-    log_progress(f"   Summary: {len(high_priority)} high, {len(medium_priority)} medium, {len(low_priority)} low priority issues")
+        for file_path, file_data in sorted(files_with_issues.items()):
+            total = file_data['high_count'] + file_data['medium_count'] + file_data['low_count']
+            scanned = file_data['scanned_at'].split('T')[0] if 'T' in file_data['scanned_at'] else file_data['scanned_at']
+            fh.write(f"| `{file_path}` | {file_data['high_count']} | {file_data['medium_count']} | {file_data['low_count']} | **{total}** | {scanned} |\n")
+        
+        # Add issue type breakdown
+        if issue_types:
+            fh.write(f"\n---\n\n## 📈 Issue Type Breakdown\n\n")
+            fh.write("| Type | High | Medium | Low | Total |\n")
+            fh.write("|------|------|--------|-----|-------|\n")
+            for issue_type, counts in sorted(issue_types.items()):
+                total = counts['high'] + counts['medium'] + counts['low']
+                fh.write(f"| {issue_type} | {counts['high']} | {counts['medium']} | {counts['low']} | **{total}** |\n")
+        
+        # Add section for files with scan errors
+        if files_with_errors:
+            fh.write(f"\n---\n\n## ⚠️ Files with Scan Errors ({len(files_with_errors)})\n\n")
+            fh.write("These files encountered errors during scanning and may need to be rescanned:\n\n")
+            fh.write("| File | Error Type | Error Message | Scanned At |\n")
+            fh.write("|------|------------|---------------|------------|\n")
+            for error_info in files_with_errors:
+                file_path = error_info['file']
+                error_type = error_info['error_type']
+                error_msg = error_info['error_message'][:100] + "..." if len(error_info['error_message']) > 100 else error_info['error_message']
+                scanned = error_info['scanned_at'].split('T')[0] if 'T' in error_info['scanned_at'] else error_info['scanned_at']
+                fh.write(f"| `{file_path}` | {error_type} | {error_msg} | {scanned} |\n")
+            fh.write(f"\n💡 **Tip:** Files with connection errors can be rescanned by deleting their row from the `results` table in `code_analysis_findings.db` or running the scanner again (it will skip unchanged files).\n\n")
+    
+    log_progress(f"\n✅ Report saved to {REPORT_FILE}")
+    log_progress(f"   Summary: {severity_counts['high']} high, {severity_counts['medium']} medium, {severity_counts['low']} low priority issues")
 
 def show_status():
     """Show current scan status"""
@@ -714,6 +1742,10 @@ if __name__ == "__main__":
     elif len(sys.argv) > 1 and sys.argv[1] == "report":
         findings = load_findings()
         generate_report(findings)
+    elif len(sys.argv) > 1 and sys.argv[1] == "batch":
+        print("Starting batch scan... (Press Ctrl+C to stop waiting; run again to resume)")
+        findings = batch_scan_repos(config)
+        generate_report(findings)
     else:
         print("Starting scan... (Press Ctrl+C to pause and resume later)")
         findings = scan_repos(config)